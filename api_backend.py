@@ -1,8 +1,14 @@
-from fastapi import FastAPI, HTTPException, status
-from pydantic import BaseModel, ValidationError
+from fastapi import Depends, FastAPI, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from starlette.datastructures import Headers, MutableHeaders
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional
 from openai import OpenAI
 import json
+import os
+import secrets
+import uuid
+import tracing
 
 # Initialize FastAPI app
 app = FastAPI()
@@ -16,6 +22,10 @@ class Request(BaseModel):
     role: Optional[str] = None                      # (Optional) Target role
     interview_type: Optional[list[str]] = None      # (Optional) Interview type
 
+# Schema for arming the sampling profiler
+class ProfileRequest(BaseModel):
+    requests: int = Field(gt=0, le=1000)            # Number of upcoming requests to profile
+
 # Schema for a single follow-up question
 class FollowUp(BaseModel):
     followup_question: str
@@ -28,6 +38,9 @@ class FollowUpResponse(BaseModel):
 # Model to be used for generating follow-up questions
 gpt_model = "gpt-5-mini"
 
+# Token required by the admin endpoints; they are disabled when unset
+admin_token = os.getenv("ADMIN_TOKEN")
+
 # System-level instructions for the model to ensure safe, professional outputs
 system_prompt = """
     You are an interviewer assistant. Generate 1–3 concise follow-up questions, that are each less than 50 words, based only on the candidate's answer and the original question. 
@@ -39,18 +52,19 @@ system_prompt = """
 def call_openai(client, question: str, answer: str, role: str = "n/a", interview_type: str = "n/a"):
     try:
         # Attempt to call OpenAI API
-        response = client.responses.create(
-            model=gpt_model,
-            reasoning={"effort": "medium"},
-            max_output_tokens=1000,
-            instructions=system_prompt,
-            input=f"""
-                Original Question: {question}
-                Candidate Answer: {answer} 
-                Role: {role}
-                Interview type: {interview_type}
-                """
-        )
+        with tracing.span("call_openai", **{"llm.model": gpt_model}):
+            response = client.responses.create(
+                model=gpt_model,
+                reasoning={"effort": "medium"},
+                max_output_tokens=1000,
+                instructions=system_prompt,
+                input=f"""
+                    Original Question: {question}
+                    Candidate Answer: {answer} 
+                    Role: {role}
+                    Interview type: {interview_type}
+                    """
+            )
     # Raise error if model is unavailable
     except Exception as e:
         raise HTTPException(
@@ -63,6 +77,104 @@ def call_openai(client, question: str, answer: str, role: str = "n/a", interview
         )
     return response
 
+class TraceRequests:
+    """
+    ASGI middleware tracing every HTTP request under a request ID, reusing the caller's X-Request-ID if provided.
+
+    The root span stays open until the app returns, i.e. after the last body chunk has been sent.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        request_id = Headers(scope=scope).get("x-request-id") or uuid.uuid4().hex
+        with tracing.trace_request(method, request_id) as trace:
+            trace.root.attributes.update({"http.method": method, "url.path": scope["path"]})
+
+            async def send_with_request_id(message):
+                # Record the status and return the request ID with the response headers
+                if message["type"] == "http.response.start":
+                    trace.root.attributes["http.status_code"] = message["status"]
+                    if message["status"] >= 500:
+                        trace.root.error = f"HTTP {message['status']}"
+                    MutableHeaders(scope=message).append("X-Request-ID", request_id)
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            finally:
+                # Name the span after the matched route template so probes and path parameters group together
+                route = scope.get("route")
+                route_path = route.path if route else "unmatched"
+                trace.root.name = f"{method} {route_path}"
+                trace.root.attributes["http.route"] = route_path
+
+app.add_middleware(TraceRequests)
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    # Reject the request unless admin access is configured and the token matches
+    if not admin_token or not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail={
+                "result": "failure",
+                "message": "Admin access denied."
+            }
+        )
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+def start_profiling(request: ProfileRequest):
+    """
+    Arm the sampling profiler for the next N follow-up requests.
+
+    Input: ProfileRequest object containing the number of requests to profile.
+    Output: JSON with the profiler status.
+    """
+    tracing.profiler.arm(request.requests)
+    return {
+        "result": "success",
+        "message": "Profiler armed.",
+        "data": tracing.profiler.status()
+    }
+
+@app.delete("/admin/profile", dependencies=[Depends(require_admin)])
+def stop_profiling():
+    """
+    Disarm the sampling profiler early, keeping the stacks sampled so far.
+
+    Output: JSON with the profiler status.
+    """
+    tracing.profiler.disarm()
+    return {
+        "result": "success",
+        "message": "Profiler disarmed.",
+        "data": tracing.profiler.status()
+    }
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+def get_profile():
+    """
+    Return the stacks sampled by the profiler in folded (flamegraph-ready) format.
+
+    Output: Plain text, one "frame;frame;frame count" line per unique stack.
+    """
+    profiler_status = tracing.profiler.status()
+    # Raise error if profiled requests are still pending or in flight
+    if profiler_status["remaining"] or profiler_status["active"]:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "result": "failure",
+                "message": "Profiling still in progress.",
+                "data": profiler_status
+            }
+        )
+    return PlainTextResponse(tracing.profiler.folded())
+
 @app.post("/interview/generate-followups")
 def generate_followups(request: Request):
     """
@@ -71,6 +183,11 @@ def generate_followups(request: Request):
     Input: Request object containing original question, answer, role, and interview type.
     Output: JSON with generated follow-up questions and rationales.
     """
+    # Record the handler as one span, profiling the request if a profiling slot is available
+    with tracing.span("generate_followups"), tracing.profile_request():
+        return _generate_followups(request)
+
+def _generate_followups(request: Request):
     # Extract required values
     question = request.question
     answer = request.answer
@@ -104,7 +221,8 @@ def generate_followups(request: Request):
 
     try:
         # Attempt to parse the model's JSON output and extract "followups" list
-        followups = FollowUpResponse.model_validate_json(output_text)
+        with tracing.span("parse_output", **{"output.length": len(output_text)}):
+            followups = FollowUpResponse.model_validate_json(output_text)
         #followups = FollowUpResponse.parse_raw(response.output_text)["followups"]
     except (json.JSONDecodeError, KeyError, ValidationError):
         # Raise error if output is not valid JSON or missing expected keys
@@ -130,8 +248,10 @@ def generate_followups(request: Request):
     )
 
     # Successful parsing; return follow-up questions to client
+    with tracing.span("build_response"):
+        data = followups.model_dump()
     return {
         "result": "success",
         "message": "Follow-up question generated.",
-        "data": followups.model_dump()
+        "data": data
     }
\ No newline at end of file
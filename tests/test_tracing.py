@@ -0,0 +1,274 @@
+import json
+import logging
+import threading
+import time
+from unittest.mock import patch, MagicMock
+import pytest
+from fastapi.testclient import TestClient
+import api_backend
+import tracing
+from api_backend import app
+
+client = TestClient(app)
+
+# A valid request, missing optional fields (no role or interview_type)
+minimal_request = {
+    "question": "Can you describe a project where you implemented AI or machine learning to solve a real-world problem?",
+    "answer": "I developed a chatbot using large language models for customer support."
+}
+
+# Valid response from OpenAI in JSON format
+valid_output_text = {
+    "followups": [
+        {
+            "followup_question": "Which LLM did you use, and did you fine-tune it or rely on prompting?",
+            "rationale": "To assess technical decisions around model selection."
+        }
+    ]
+}
+
+# Write traces to a temporary file for every test
+@pytest.fixture(autouse=True)
+def trace_file(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "trace_export_path", str(path))
+    return path
+
+# Give every test its own profiler, disarmed afterwards so leftover slots never leak into other tests
+@pytest.fixture(autouse=True)
+def fresh_profiler(monkeypatch):
+    profiler = tracing.SamplingProfiler()
+    monkeypatch.setattr(tracing, "profiler", profiler)
+    yield profiler
+    profiler.arm(0)
+
+# Mock the OpenAI client to simulate a successful response
+@pytest.fixture
+def mock_openai():
+    with patch("api_backend.client.responses.create") as mock_create:
+        mock_response = MagicMock()
+        mock_response.status = "succeeded"
+        mock_response.output_text = json.dumps(valid_output_text)
+        mock_create.return_value = mock_response
+        yield mock_create
+
+# Read back the exported traces as a list of span lists
+def read_spans(path):
+    tracing.flush()
+    lines = path.read_text().splitlines()
+    return [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"] for line in lines]
+
+# Test 1: Request ID is generated and returned
+def test_request_id_generated(mock_openai):
+    response = client.post("/interview/generate-followups", json=minimal_request)
+    # Check that a request ID is returned in the headers
+    assert response.status_code == 200
+    assert response.headers["x-request-id"]
+
+# Test 2: Caller-supplied request ID is reused
+def test_request_id_propagated(mock_openai, trace_file):
+    response = client.post("/interview/generate-followups", json=minimal_request, headers={"X-Request-ID": "abc123"})
+    # Check that the header is echoed back and recorded on the root span
+    assert response.headers["x-request-id"] == "abc123"
+    root = read_spans(trace_file)[0][0]
+    assert {"key": "request.id", "value": {"stringValue": "abc123"}} in root["attributes"]
+
+# Test 3: Every stage is exported as a span in OTLP JSON
+def test_spans_exported(mock_openai, trace_file):
+    client.post("/interview/generate-followups", json=minimal_request)
+    spans = read_spans(trace_file)[0]
+    by_name = {span["name"]: span for span in spans}
+    # Check that all stages were recorded
+    for name in ["POST /interview/generate-followups", "dispatch", "generate_followups", "call_openai", "parse_output", "build_response", "serialize"]:
+        assert name in by_name
+    # Check that the spans share a trace and nest under the handler
+    assert len({span["traceId"] for span in spans}) == 1
+    assert by_name["call_openai"]["parentSpanId"] == by_name["generate_followups"]["spanId"]
+    assert by_name["generate_followups"]["parentSpanId"] == by_name["POST /interview/generate-followups"]["spanId"]
+    # Check that timestamps are OTLP nanosecond strings
+    assert int(by_name["call_openai"]["endTimeUnixNano"]) >= int(by_name["call_openai"]["startTimeUnixNano"])
+
+# Test 4: Root spans are named after the matched route, not the raw path
+def test_root_span_uses_route(trace_file):
+    client.get("/no-such-page")
+    client.post("/interview/generate-followups", json={})
+    unmatched, matched = [spans[0] for spans in read_spans(trace_file)]
+    # Check that unmatched paths share one name and keep the raw path as an attribute
+    assert unmatched["name"] == "GET unmatched"
+    assert {"key": "url.path", "value": {"stringValue": "/no-such-page"}} in unmatched["attributes"]
+    # Check that matched requests use the route template
+    assert matched["name"] == "POST /interview/generate-followups"
+    assert {"key": "http.route", "value": {"stringValue": "/interview/generate-followups"}} in matched["attributes"]
+
+# Test 5: Failing stages are marked with an error status
+def test_error_span(trace_file):
+    with patch("api_backend.client.responses.create", side_effect=Exception("API down")):
+        response = client.post("/interview/generate-followups", json=minimal_request)
+    assert response.status_code == 500
+    by_name = {span["name"]: span for span in read_spans(trace_file)[0]}
+    # Check that both the failing stage and the request are marked as errors
+    assert by_name["call_openai"]["status"] == {"code": 2, "message": "Exception: API down"}
+    assert by_name["POST /interview/generate-followups"]["status"]["code"] == 2
+
+# Test 6: Durations use the monotonic clock, not the wall clock
+def test_duration_ignores_wall_clock():
+    # Simulate the wall clock stepping back one second while 5 ms pass on the perf counter
+    span = tracing.Span("trace", "stage", start=(10**18, 0))
+    span.end((10**18 - 10**9, 5_000_000))
+    # Check that the duration follows the perf counter
+    assert span.duration_ms == 5.0
+    # Check that the exported span keeps its wall-clock start and has the same monotonic length
+    exported = span.to_otlp()
+    assert exported["startTimeUnixNano"] == str(10**18)
+    assert exported["endTimeUnixNano"] == str(10**18 + 5_000_000)
+
+# Test 7: Traces are exported off the event loop thread
+def test_export_off_event_loop(mock_openai, monkeypatch):
+    exported = []
+    export_trace = tracing.export_trace
+    def record_thread(trace):
+        exported.append((trace.loop_thread, threading.get_ident()))
+        export_trace(trace)
+    monkeypatch.setattr(tracing, "export_trace", record_thread)
+    client.post("/interview/generate-followups", json=minimal_request)
+    tracing.flush()
+    # Check that the trace was exported, but not by the thread that served the request
+    assert len(exported) == 1
+    loop_thread, export_thread = exported[0]
+    assert export_thread != loop_thread
+
+# Test 8: Traces are dropped, not buffered, when the export queue is full
+def test_export_queue_full(monkeypatch, caplog):
+    monkeypatch.setattr(tracing._export_queue, "maxsize", 2)
+    monkeypatch.setattr(tracing, "dropped_traces", 0)
+    monkeypatch.setattr(tracing, "_last_drop_log", 0.0)
+    # Stall the writer thread on the first trace it picks up
+    exporting = threading.Event()
+    release = threading.Event()
+    def stalled_export(trace):
+        exporting.set()
+        release.wait(5)
+    monkeypatch.setattr(tracing, "export_trace", stalled_export)
+    def finished_trace():
+        trace = tracing.Trace("GET /", "queued")
+        trace.finish()
+        return trace
+    tracing.submit_trace(finished_trace())
+    assert exporting.wait(5)
+    # Fill the queue, then overflow it three times
+    with caplog.at_level(logging.WARNING, logger="api_backend.tracing"):
+        for _ in range(5):
+            tracing.submit_trace(finished_trace())
+    # Check that the overflow was counted and logged only once
+    assert tracing.dropped_traces == 3
+    assert tracing._export_queue.qsize() == 2
+    assert caplog.text.count("Trace export queue full") == 1
+    release.set()
+    tracing.flush()
+
+# Test 9: Slow requests are logged with their span breakdown
+def test_slow_request_logged(mock_openai, monkeypatch, caplog):
+    monkeypatch.setattr(tracing, "slow_request_ms", 0)
+    with caplog.at_level(logging.WARNING, logger="api_backend.tracing"):
+        client.post("/interview/generate-followups", json=minimal_request, headers={"X-Request-ID": "slow1"})
+        tracing.flush()
+    # Check that the log names the request and each stage
+    assert "Slow request slow1" in caplog.text
+    assert "call_openai" in caplog.text
+    assert "parse_output" in caplog.text
+
+# Test 10: Admin endpoints reject missing or wrong tokens
+def test_admin_requires_token(monkeypatch):
+    monkeypatch.setattr(api_backend, "admin_token", "secret")
+    # Check that missing and wrong tokens are rejected with 403
+    assert client.post("/admin/profile", json={"requests": 1}).status_code == 403
+    response = client.get("/admin/profile", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403
+    assert response.json()["detail"]["message"] == "Admin access denied."
+    # Check that a non-ASCII token is rejected rather than raising
+    response = client.get("/admin/profile", headers={"X-Admin-Token": "\xe9".encode("latin-1")})
+    assert response.status_code == 403
+
+# Test 11: Admin endpoints are disabled when no token is configured
+def test_admin_disabled_without_token(monkeypatch):
+    monkeypatch.setattr(api_backend, "admin_token", None)
+    response = client.post("/admin/profile", json={"requests": 1}, headers={"X-Admin-Token": ""})
+    assert response.status_code == 403
+
+# Test 12: Profiling the next N requests returns a folded stack dump
+def test_profile_requests(mock_openai, monkeypatch):
+    monkeypatch.setattr(api_backend, "admin_token", "secret")
+    headers = {"X-Admin-Token": "secret"}
+    # Slow the mocked upstream call down so the sampler catches it
+    def slow_create(**kwargs):
+        time.sleep(0.05)
+        return mock_openai.return_value
+    mock_openai.side_effect = slow_create
+    response = client.post("/admin/profile", json={"requests": 2}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["data"]["remaining"] == 2
+    # Check that the dump is unavailable until the profiled requests have run
+    assert client.get("/admin/profile", headers=headers).status_code == 409
+    client.post("/interview/generate-followups", json=minimal_request)
+    client.post("/interview/generate-followups", json=minimal_request)
+    response = client.get("/admin/profile", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    # Check that each line is a folded stack followed by a sample count
+    lines = response.text.splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.split(";")[0] in ("worker", "event_loop")
+        assert int(count) >= 1
+    assert any("call_openai" in line for line in lines)
+
+# Test 13: Only follow-up requests consume profiling slots
+def test_profile_ignores_other_requests(mock_openai, monkeypatch):
+    monkeypatch.setattr(api_backend, "admin_token", "secret")
+    headers = {"X-Admin-Token": "secret"}
+    client.post("/admin/profile", json={"requests": 1}, headers=headers)
+    # Send unrelated and invalid requests while the profiler is armed
+    client.get("/docs")
+    client.get("/openapi.json")
+    client.post("/interview/generate-followups", json={})
+    # Check that the slot is still available
+    response = client.get("/admin/profile", headers=headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["data"]["remaining"] == 1
+    # Check that the next follow-up request is the one profiled
+    client.post("/interview/generate-followups", json=minimal_request)
+    assert tracing.profiler.status()["remaining"] == 0
+
+# Test 14: Disarming early returns the stacks from the requests profiled so far
+def test_profile_disarm_early(mock_openai, monkeypatch):
+    monkeypatch.setattr(api_backend, "admin_token", "secret")
+    headers = {"X-Admin-Token": "secret"}
+    def slow_create(**kwargs):
+        time.sleep(0.05)
+        return mock_openai.return_value
+    mock_openai.side_effect = slow_create
+    # Arm for 3 requests but only send 2
+    client.post("/admin/profile", json={"requests": 3}, headers=headers)
+    client.post("/interview/generate-followups", json=minimal_request)
+    client.post("/interview/generate-followups", json=minimal_request)
+    response = client.get("/admin/profile", headers=headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["data"]["remaining"] == 1
+    # Check that disarming keeps the samples already collected
+    response = client.delete("/admin/profile", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["data"]["remaining"] == 0
+    assert response.json()["data"]["samples"] > 0
+    # Check that the partial dump is now returned
+    response = client.get("/admin/profile", headers=headers)
+    assert response.status_code == 200
+    assert any("call_openai" in line for line in response.text.splitlines())
+    # Check that disarming also requires the admin token
+    assert client.delete("/admin/profile").status_code == 403
+
+# Test 15: Profiler argument is validated
+def test_profile_invalid_count(monkeypatch):
+    monkeypatch.setattr(api_backend, "admin_token", "secret")
+    response = client.post("/admin/profile", json={"requests": 0}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 422
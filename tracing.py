@@ -0,0 +1,375 @@
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger("api_backend.tracing")
+
+# Name reported as the OTLP resource's service.name
+service_name = "genai-interview-followup"
+# File that finished traces are appended to, one OTLP JSON document per line (export is off when unset)
+trace_export_path = os.getenv("TRACE_EXPORT_PATH", "")
+# Requests taking at least this long (in milliseconds) are logged with their span breakdown
+slow_request_ms = float(os.getenv("SLOW_REQUEST_MS", "10000"))
+# Maximum number of finished traces waiting for the writer thread; further traces are dropped
+export_queue_size = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+# Minimum number of seconds between warnings about dropped traces
+drop_log_interval = 60.0
+
+# Trace and span belonging to the request currently being handled
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+# Finished traces waiting to be exported, drained by a background writer thread
+_export_queue = queue.Queue(maxsize=export_queue_size)
+_exporter = None
+_exporter_lock = threading.Lock()
+# Traces dropped because the export queue was full, and when that was last logged
+dropped_traces = 0
+_last_drop_log = 0.0
+
+
+def _otlp_value(value):
+    # Map a Python attribute value onto an OTLP AnyValue
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _now() -> tuple:
+    # Current (wall clock, perf counter) reading in nanoseconds
+    return time.time_ns(), time.perf_counter_ns()
+
+
+class Span:
+    """
+    A single timed stage of a request.
+
+    Each boundary is a (wall clock, perf counter) pair in nanoseconds: the wall clock anchors the
+    OTLP start timestamp, while the monotonic perf counter gives every duration, including the exported one.
+    """
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str] = None, start: Optional[tuple] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start or _now()
+        self.stop = None
+        self.attributes = {}
+        self.error = None
+
+    def end(self, stop: Optional[tuple] = None):
+        self.stop = stop or _now()
+
+    @property
+    def duration_ms(self) -> float:
+        stop = self.stop or _now()
+        return (stop[1] - self.start[1]) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,     # SPAN_KIND_SERVER for the root, INTERNAL otherwise
+            "startTimeUnixNano": str(self.start[0]),
+            "endTimeUnixNano": str(self.start[0] + self.stop[1] - self.start[1]),    # Monotonic length from the wall-clock start
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """
+    All spans recorded for one request, rooted at a server span named after the route.
+    """
+    def __init__(self, name: str, request_id: str):
+        self.request_id = request_id
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(self.trace_id, name)
+        self.root.attributes["request.id"] = request_id
+        self.spans = [self.root]
+        self.profiled = False
+        self.loop_thread = threading.get_ident()       # Thread the trace was started on (the event loop)
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, parent: Optional[Span] = None, start: Optional[tuple] = None) -> Span:
+        span = Span(self.trace_id, name, (parent or self.root).span_id, start)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def finish(self):
+        """
+        End the root span and fill in the time spent outside the handler.
+
+        "dispatch" covers reading the body, validating it and waiting for a threadpool worker;
+        "serialize" covers encoding the returned envelope and sending the HTTP response.
+        """
+        self.root.end()
+        children = [s for s in self.spans if s.parent_id == self.root.span_id]
+        if not children:
+            return
+        first = min(children, key=lambda s: s.start[1])
+        last = max(children, key=lambda s: (s.stop or self.root.stop)[1])
+        self.start_span("dispatch", start=self.root.start).end(first.start)
+        self.start_span("serialize", start=last.stop or self.root.stop).end(self.root.stop)
+
+    def breakdown(self) -> str:
+        # Render the span tree as indented lines, e.g. "  call_openai  812.4 ms"
+        lines = []
+        def walk(span, depth):
+            status = f"  [error: {span.error}]" if span.error else ""
+            lines.append(f"{'  ' * depth}{span.name}  {span.duration_ms:.1f} ms{status}")
+            for child in sorted((s for s in self.spans if s.parent_id == span.span_id), key=lambda s: s.start[1]):
+                walk(child, depth + 1)
+        walk(self.root, 0)
+        return "\n".join(lines)
+
+    def to_otlp(self) -> dict:
+        # Shape matches an OTLP/JSON ExportTraceServiceRequest
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": _otlp_value(service_name)}]},
+                "scopeSpans": [{
+                    "scope": {"name": "api_backend.tracing"},
+                    "spans": [span.to_otlp() for span in self.spans],
+                }],
+            }]
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_request(name: str, request_id: str):
+    """
+    Record a trace for the enclosed request, then hand it to the exporter.
+    """
+    trace = Trace(name, request_id)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    try:
+        yield trace
+    except Exception as e:
+        trace.root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        # Stop sampling the event loop once the response has been sent
+        if trace.profiled:
+            profiler.detach(trace.loop_thread)
+        trace.finish()
+        submit_trace(trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as a child of the current span; a no-op outside a traced request.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, _current_span.get())
+    current.attributes.update(attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def submit_trace(trace: Trace):
+    """
+    Queue a finished trace for export and slow-request logging.
+
+    Serialization and file I/O happen on a background thread so they never stall the event loop.
+    If the writer falls behind and the queue is full, the trace is dropped rather than buffered.
+    """
+    global _exporter, dropped_traces, _last_drop_log
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=_run_exporter, name="trace-exporter", daemon=True)
+            _exporter.start()
+    try:
+        _export_queue.put_nowait(trace)
+        return
+    except queue.Full:
+        pass
+    with _exporter_lock:
+        dropped_traces += 1
+        now = time.monotonic()
+        if now - _last_drop_log < drop_log_interval:
+            return
+        _last_drop_log = now
+        dropped = dropped_traces
+    logger.warning("Trace export queue full; %d traces dropped so far", dropped)
+
+
+def flush():
+    # Block until every queued trace has been exported
+    _export_queue.join()
+
+
+def _run_exporter():
+    while True:
+        trace = _export_queue.get()
+        try:
+            export_trace(trace)
+            if trace.root.duration_ms >= slow_request_ms:
+                logger.warning("Slow request %s took %.1f ms:\n%s", trace.request_id, trace.root.duration_ms, trace.breakdown())
+        except Exception:
+            logger.exception("Failed to process trace %s", trace.request_id)
+        finally:
+            _export_queue.task_done()
+
+
+def export_trace(trace: Trace):
+    # Append the trace to the export file; tracing must never fail the request itself
+    if not trace_export_path:
+        return
+    line = json.dumps(trace.to_otlp())
+    try:
+        with open(trace_export_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logger.error("Failed to export trace %s: %s", trace.request_id, e)
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of threads serving profiled requests.
+
+    Stacks are aggregated in folded format ("frame;frame;frame count"), which flamegraph.pl
+    and speedscope read directly. A single background thread runs only while requests are attached.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._threads = {}              # thread ident -> [label, number of attached requests]
+        self._stacks = Counter()
+        self._samples = 0
+        self._sampler = None
+
+    def arm(self, requests: int):
+        # Profile the next `requests` requests, discarding any previous dump
+        with self._lock:
+            self._remaining = requests
+            self._stacks.clear()
+            self._samples = 0
+
+    def disarm(self):
+        # Stop claiming new requests, keeping the stacks sampled so far
+        with self._lock:
+            self._remaining = 0
+
+    def claim(self) -> bool:
+        # Reserve a profiling slot for the calling request, if any remain
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def attach(self, ident: int, label: str):
+        # Start sampling thread `ident`, labelled `label`, until it is detached as many times as attached
+        with self._lock:
+            entry = self._threads.setdefault(ident, [label, 0])
+            entry[1] += 1
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._sampler.start()
+
+    def detach(self, ident: int):
+        with self._lock:
+            entry = self._threads.get(ident)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._threads[ident]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._threads:
+                    self._sampler = None
+                    return
+                targets = {ident: entry[0] for ident, entry in self._threads.items()}
+            frames = sys._current_frames()
+            folded = [_fold(label, frames[ident]) for ident, label in targets.items() if ident in frames]
+            with self._lock:
+                self._stacks.update(folded)
+                self._samples += len(folded)
+            time.sleep(self.interval)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "remaining": self._remaining,
+                "active": sum(entry[1] for entry in self._threads.values()),
+                "samples": self._samples,
+            }
+
+    def folded(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+def _fold(label: str, frame) -> str:
+    # Build a root-first, semicolon-separated stack for one sampled thread
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    names.append(label)
+    return ";".join(reversed(names))
+
+
+# Process-wide profiler, armed through the admin endpoint
+profiler = SamplingProfiler()
+
+
+@contextmanager
+def profile_request():
+    """
+    Claim a profiling slot for the current request and, if one is free, sample its worker thread
+    while the enclosed block runs and the event loop until the response has been sent.
+    """
+    trace = _current_trace.get()
+    if trace is None or not profiler.claim():
+        yield
+        return
+    trace.profiled = True
+    profiler.attach(trace.loop_thread, "event_loop")
+    worker = threading.get_ident()
+    profiler.attach(worker, "worker")
+    try:
+        yield
+    finally:
+        profiler.detach(worker)